@@ -1,10 +1,15 @@
 # SPDX-License-Identifier: Apache-2.0
 
+from types import SimpleNamespace
 from typing import Optional
 
 import pytest
 import torch
 
+import vllm.attention.backends.flash_attn as flash_attn_backend
+from vllm.attention.backends.abstract import AttentionType
+from vllm.attention.backends.flash_attn import (FlashAttentionImpl,
+                                                FlashAttentionMetadata)
 from vllm.platforms import current_platform
 from vllm.vllm_flash_attn import (fa_version_unsupported_reason,
                                   flash_attn_varlen_func,
@@ -314,3 +319,402 @@ def test_varlen_with_paged_kv(
         atol, rtol = 1.5e-1, 1.5e-1
     torch.testing.assert_close(output, ref_output, atol=atol, rtol=rtol), \
         f"{torch.max(torch.abs(output - ref_output))}"
+
+
+@pytest.mark.parametrize("decode_query_len", [2, 4])
+@pytest.mark.parametrize("kv_lens", [[1328, 18, 463], [54, 293, 70, 9]])
+@pytest.mark.parametrize("num_heads", NUM_HEADS)
+@pytest.mark.parametrize("head_size", HEAD_SIZES)
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+@pytest.mark.parametrize("sliding_window", [None, 256])
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("fa_version", [2, 3])
+@torch.inference_mode()
+def test_uniform_multi_token_decode_with_kvcache(
+    decode_query_len: int,
+    kv_lens: list[int],
+    num_heads: tuple[int, int],
+    head_size: int,
+    block_size: int,
+    sliding_window: Optional[int],
+    dtype: torch.dtype,
+    fa_version: int,
+) -> None:
+    """Decodes of the same query length, viewed as
+    [num_decodes, decode_query_len, num_heads, head_size], give the same
+    output through flash_attn_with_kvcache as through the varlen kernel."""
+    torch.set_default_device("cuda")
+    if not is_fa_version_supported(fa_version):
+        pytest.skip(f"Flash attention version {fa_version} not supported due "
+                    f"to: \"{fa_version_unsupported_reason(fa_version)}\"")
+    current_platform.seed_everything(0)
+    num_blocks = 2048
+    num_decodes = len(kv_lens)
+    num_query_heads = num_heads[0]
+    num_kv_heads = num_heads[1]
+    max_kv_len = max(kv_lens)
+    window_size = ((sliding_window - 1, 0) if sliding_window is not None else
+                   (-1, -1))
+    scale = head_size**-0.5
+
+    query = torch.randn(num_decodes * decode_query_len,
+                        num_query_heads,
+                        head_size,
+                        dtype=dtype)
+    key_cache = torch.randn(num_blocks,
+                            block_size,
+                            num_kv_heads,
+                            head_size,
+                            dtype=dtype)
+    value_cache = torch.randn_like(key_cache)
+    cu_query_lens = torch.arange(0, (num_decodes + 1) * decode_query_len,
+                                 decode_query_len,
+                                 dtype=torch.int32)
+    kv_lens_tensor = torch.tensor(kv_lens, dtype=torch.int32)
+    max_num_blocks_per_seq = (max_kv_len + block_size - 1) // block_size
+    block_tables = torch.randint(0,
+                                 num_blocks,
+                                 (num_decodes, max_num_blocks_per_seq),
+                                 dtype=torch.int32)
+
+    output = torch.empty_like(query)
+    flash_attn_with_kvcache(
+        q=query.view(num_decodes, decode_query_len, *query.shape[1:]),
+        k_cache=key_cache,
+        v_cache=value_cache,
+        block_table=block_tables,
+        cache_seqlens=kv_lens_tensor,
+        softmax_scale=scale,
+        causal=True,
+        window_size=window_size,
+        out=output.view(num_decodes, decode_query_len, *output.shape[1:]),
+        fa_version=fa_version,
+    )
+
+    varlen_output = torch.empty_like(query)
+    flash_attn_varlen_func(
+        q=query,
+        k=key_cache,
+        v=value_cache,
+        cu_seqlens_q=cu_query_lens,
+        max_seqlen_q=decode_query_len,
+        seqused_k=kv_lens_tensor,
+        max_seqlen_k=max_kv_len,
+        softmax_scale=scale,
+        causal=True,
+        window_size=window_size,
+        block_table=block_tables,
+        out=varlen_output,
+        fa_version=fa_version,
+    )
+    torch.testing.assert_close(output, varlen_output, atol=1.5e-2, rtol=1e-2)
+
+
+@pytest.mark.parametrize("prefill_lens", [[(129, 463), (5, 18)]])
+@pytest.mark.parametrize("decode_kv_lens", [[1328, 37, 256]])
+@pytest.mark.parametrize("num_heads", NUM_HEADS)
+@pytest.mark.parametrize("head_size", HEAD_SIZES)
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+@pytest.mark.parametrize("sliding_window", [None, 256])
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("q_dtype", QDTYPES)
+@torch.inference_mode()
+def test_mixed_batch_single_varlen_call(
+    prefill_lens: list[tuple[int, int]],
+    decode_kv_lens: list[int],
+    num_heads: tuple[int, int],
+    head_size: int,
+    block_size: int,
+    sliding_window: Optional[int],
+    dtype: torch.dtype,
+    q_dtype: Optional[torch.dtype],
+) -> None:
+    """A mixed prefill + decode batch attended with a single paged
+    flash_attn_varlen_func call matches a varlen call over the prefills
+    followed by a flash_attn_with_kvcache call over the decodes."""
+    torch.set_default_device("cuda")
+    fa_version = 3
+    if not is_fa_version_supported(fa_version):
+        pytest.skip(f"Flash attention version {fa_version} not supported due "
+                    f"to: \"{fa_version_unsupported_reason(fa_version)}\"")
+    if q_dtype is not None and dtype != torch.bfloat16:
+        pytest.skip("Flash attention with quantized inputs is only "
+                    "supported on version 3 with bfloat16 base type")
+    current_platform.seed_everything(0)
+    num_blocks = 2048
+    num_prefills = len(prefill_lens)
+    num_decodes = len(decode_kv_lens)
+    query_lens = [x[0] for x in prefill_lens] + [1] * num_decodes
+    kv_lens = [x[1] for x in prefill_lens] + decode_kv_lens
+    num_seqs = len(query_lens)
+    num_prefill_tokens = sum(query_lens[:num_prefills])
+    num_query_heads = num_heads[0]
+    num_kv_heads = num_heads[1]
+    max_query_len = max(query_lens)
+    max_kv_len = max(kv_lens)
+    window_size = ((sliding_window - 1, 0) if sliding_window is not None else
+                   (-1, -1))
+    scale = head_size**-0.5
+
+    query = torch.randn(sum(query_lens),
+                        num_query_heads,
+                        head_size,
+                        dtype=dtype)
+    key_cache = torch.randn(num_blocks,
+                            block_size,
+                            num_kv_heads,
+                            head_size,
+                            dtype=dtype)
+    value_cache = torch.randn_like(key_cache)
+    cu_query_lens = torch.tensor([0] + query_lens,
+                                 dtype=torch.int32).cumsum(dim=0,
+                                                           dtype=torch.int32)
+    kv_lens_tensor = torch.tensor(kv_lens, dtype=torch.int32)
+    max_num_blocks_per_seq = (max_kv_len + block_size - 1) // block_size
+    block_tables = torch.randint(0,
+                                 num_blocks,
+                                 (num_seqs, max_num_blocks_per_seq),
+                                 dtype=torch.int32)
+
+    maybe_quantized_query = query
+    maybe_quantized_key_cache = key_cache
+    maybe_quantized_value_cache = value_cache
+    q_descale = None
+    k_descale = None
+    v_descale = None
+    if q_dtype is not None:
+        # QKV are drawn from N(0, 1): no need for a fp8 scaling factor
+        maybe_quantized_query = query.to(q_dtype)
+        maybe_quantized_key_cache = key_cache.to(q_dtype)
+        maybe_quantized_value_cache = value_cache.to(q_dtype)
+
+        scale_shape = (num_seqs, num_kv_heads)
+        q_descale = torch.ones(scale_shape, dtype=torch.float32)
+        k_descale = torch.ones(scale_shape, dtype=torch.float32)
+        v_descale = torch.ones(scale_shape, dtype=torch.float32)
+
+    output = torch.empty_like(query)
+    flash_attn_varlen_func(
+        q=maybe_quantized_query,
+        k=maybe_quantized_key_cache,
+        v=maybe_quantized_value_cache,
+        cu_seqlens_q=cu_query_lens,
+        max_seqlen_q=max_query_len,
+        seqused_k=kv_lens_tensor,
+        max_seqlen_k=max_kv_len,
+        softmax_scale=scale,
+        causal=True,
+        window_size=window_size,
+        block_table=block_tables,
+        out=output,
+        fa_version=fa_version,
+        q_descale=q_descale,
+        k_descale=k_descale,
+        v_descale=v_descale,
+    )
+
+    ref_output = torch.empty_like(query)
+    flash_attn_varlen_func(
+        q=maybe_quantized_query[:num_prefill_tokens],
+        k=maybe_quantized_key_cache,
+        v=maybe_quantized_value_cache,
+        cu_seqlens_q=cu_query_lens[:num_prefills + 1],
+        max_seqlen_q=max(query_lens[:num_prefills]),
+        seqused_k=kv_lens_tensor[:num_prefills],
+        max_seqlen_k=max(kv_lens[:num_prefills]),
+        softmax_scale=scale,
+        causal=True,
+        window_size=window_size,
+        block_table=block_tables[:num_prefills],
+        out=ref_output[:num_prefill_tokens],
+        fa_version=fa_version,
+        q_descale=(q_descale[:num_prefills]
+                   if q_descale is not None else None),
+        k_descale=(k_descale[:num_prefills]
+                   if k_descale is not None else None),
+        v_descale=(v_descale[:num_prefills]
+                   if v_descale is not None else None),
+    )
+    flash_attn_with_kvcache(
+        q=maybe_quantized_query[num_prefill_tokens:].unsqueeze(1),
+        k_cache=maybe_quantized_key_cache,
+        v_cache=maybe_quantized_value_cache,
+        block_table=block_tables[num_prefills:],
+        cache_seqlens=kv_lens_tensor[num_prefills:],
+        softmax_scale=scale,
+        causal=True,
+        window_size=window_size,
+        out=ref_output[num_prefill_tokens:].unsqueeze(1),
+        fa_version=fa_version,
+        q_descale=(q_descale[num_prefills:]
+                   if q_descale is not None else None),
+        k_descale=(k_descale[num_prefills:]
+                   if k_descale is not None else None),
+        v_descale=(v_descale[num_prefills:]
+                   if v_descale is not None else None),
+    )
+
+    atol, rtol = 1.5e-2, 1e-2
+    if q_dtype is not None:
+        atol, rtol = 1.5e-1, 1.5e-1
+    torch.testing.assert_close(output, ref_output, atol=atol, rtol=rtol)
+
+
+@pytest.mark.parametrize("fa_version", [2, 3])
+@pytest.mark.parametrize("num_heads", [(8, 2)])
+@pytest.mark.parametrize("head_size", [128])
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+@pytest.mark.parametrize("sliding_window", [None, 256])
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("kv_cache_dtype", ["auto", "fp8"])
+@torch.inference_mode()
+def test_forward_mixed_batch(
+    monkeypatch: pytest.MonkeyPatch,
+    fa_version: int,
+    num_heads: tuple[int, int],
+    head_size: int,
+    block_size: int,
+    sliding_window: Optional[int],
+    dtype: torch.dtype,
+    kv_cache_dtype: str,
+) -> None:
+    """FlashAttentionImpl.forward on a mixed prefill + decode batch matches
+    running the prefill and decode metadata of the batch separately. Only
+    FA3 decoder self-attention takes the single varlen call."""
+    torch.set_default_device("cuda")
+    if not is_fa_version_supported(fa_version):
+        pytest.skip(f"Flash attention version {fa_version} not supported due "
+                    f"to: \"{fa_version_unsupported_reason(fa_version)}\"")
+    if kv_cache_dtype == "fp8" and (fa_version != 3
+                                    or dtype != torch.bfloat16):
+        pytest.skip("Flash attention with fp8 KV cache is only supported on "
+                    "version 3 with bfloat16 base type")
+    monkeypatch.setenv("VLLM_FLASH_ATTN_VERSION", str(fa_version))
+    current_platform.seed_everything(0)
+    num_blocks = 2048
+    # (query_len, kv_len) of the prefills, then of the decodes.
+    prefill_lens = [(129, 463), (5, 18)]
+    decode_kv_lens = [1328, 37, 256]
+    num_prefills = len(prefill_lens)
+    num_decodes = len(decode_kv_lens)
+    query_lens = [x[0] for x in prefill_lens] + [1] * num_decodes
+    kv_lens = [x[1] for x in prefill_lens] + decode_kv_lens
+    num_seqs = len(query_lens)
+    num_tokens = sum(query_lens)
+    num_prefill_tokens = sum(query_lens[:num_prefills])
+    num_query_heads = num_heads[0]
+    num_kv_heads = num_heads[1]
+
+    impl = FlashAttentionImpl(num_heads=num_query_heads,
+                              head_size=head_size,
+                              scale=head_size**-0.5,
+                              num_kv_heads=num_kv_heads,
+                              alibi_slopes=None,
+                              sliding_window=sliding_window,
+                              kv_cache_dtype=kv_cache_dtype,
+                              attn_type=AttentionType.DECODER)
+    assert impl.vllm_flash_attn_version == fa_version
+    scale = torch.tensor(1.0, dtype=torch.float32)
+    layer = SimpleNamespace(_q_scale=scale,
+                            _k_scale=scale,
+                            _v_scale=scale,
+                            _k_scale_float=1.0,
+                            _v_scale_float=1.0)
+
+    query = torch.randn(num_tokens, num_query_heads, head_size, dtype=dtype)
+    key = torch.randn(num_tokens, num_kv_heads, head_size, dtype=dtype)
+    value = torch.randn_like(key)
+    kv_cache = torch.randn(2,
+                           num_blocks,
+                           block_size,
+                           num_kv_heads,
+                           head_size,
+                           dtype=dtype)
+    if kv_cache_dtype == "fp8":
+        # The fp8 KV cache is allocated as uint8.
+        kv_cache = kv_cache.to(torch.float8_e4m3fn).view(torch.uint8)
+
+    # Distinct blocks per sequence, so the new tokens of one sequence do not
+    # overwrite the context of another.
+    max_num_blocks_per_seq = (max(kv_lens) + block_size - 1) // block_size
+    block_ids = torch.randperm(num_blocks, dtype=torch.int32)
+    block_tables = block_ids[:num_seqs * max_num_blocks_per_seq].view(
+        num_seqs, max_num_blocks_per_seq)
+    block_tables_list = block_tables.tolist()
+    context_lens = [
+        kv_len - query_len for query_len, kv_len in zip(query_lens, kv_lens)
+    ]
+    slot_mapping: list[int] = []
+    for i, (context_len, kv_len) in enumerate(zip(context_lens, kv_lens)):
+        for pos in range(context_len, kv_len):
+            slot_mapping.append(
+                block_tables_list[i][pos // block_size] * block_size +
+                pos % block_size)
+
+    attn_metadata = FlashAttentionMetadata(
+        num_prefills=num_prefills,
+        num_prefill_tokens=num_prefill_tokens,
+        num_decode_tokens=num_decodes,
+        slot_mapping=torch.tensor(slot_mapping, dtype=torch.long),
+        multi_modal_placeholder_index_maps=None,
+        enable_kv_scales_calculation=False,
+        seq_lens=kv_lens,
+        seq_lens_tensor=torch.tensor(kv_lens, dtype=torch.int32),
+        max_prefill_seq_len=max(kv_lens[:num_prefills]),
+        max_decode_seq_len=max(kv_lens[num_prefills:]),
+        context_lens_tensor=torch.tensor(context_lens, dtype=torch.int32),
+        block_tables=block_tables,
+        use_cuda_graph=False,
+        max_query_len=max(query_lens),
+        max_decode_query_len=1,
+        query_start_loc=torch.tensor([0] + query_lens,
+                                     dtype=torch.int32).cumsum(
+                                         dim=0, dtype=torch.int32),
+        seq_start_loc=torch.tensor([0] + kv_lens, dtype=torch.int32).cumsum(
+            dim=0, dtype=torch.int32),
+    )
+
+    num_calls = {"flash_attn_varlen_func": 0, "flash_attn_with_kvcache": 0}
+
+    def count_calls(name):
+        func = getattr(flash_attn_backend, name)
+
+        def wrapper(*args, **kwargs):
+            num_calls[name] += 1
+            return func(*args, **kwargs)
+
+        monkeypatch.setattr(flash_attn_backend, name, wrapper)
+
+    count_calls("flash_attn_varlen_func")
+    count_calls("flash_attn_with_kvcache")
+
+    output = torch.empty_like(query)
+    impl.forward(layer, query, key, value, kv_cache, attn_metadata, output)
+    if fa_version == 3:
+        assert num_calls == {
+            "flash_attn_varlen_func": 1,
+            "flash_attn_with_kvcache": 0
+        }
+    else:
+        assert num_calls == {
+            "flash_attn_varlen_func": 1,
+            "flash_attn_with_kvcache": 1
+        }
+
+    # The split path: the prefills and the decodes run on their own, each
+    # with the metadata derived from the mixed batch. The KV cache writes
+    # are the same as above.
+    ref_output = torch.empty_like(query)
+    impl.forward(layer, query[:num_prefill_tokens], key[:num_prefill_tokens],
+                 value[:num_prefill_tokens], kv_cache,
+                 attn_metadata.prefill_metadata,
+                 ref_output[:num_prefill_tokens])
+    impl.forward(layer, query[num_prefill_tokens:], key[num_prefill_tokens:],
+                 value[num_prefill_tokens:], kv_cache,
+                 attn_metadata.decode_metadata,
+                 ref_output[num_prefill_tokens:])
+
+    atol, rtol = 1.5e-2, 1e-2
+    if kv_cache_dtype == "fp8":
+        atol, rtol = 1.5e-1, 1.5e-1
+    torch.testing.assert_close(output, ref_output, atol=atol, rtol=rtol)
@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Tests for the slot mapping helpers of the attention backends."""
+import random
+from array import array
+from typing import Optional, Union
+
+import pytest
+
+from vllm.attention.backends import utils
+from vllm.attention.backends.utils import (PAD_SLOT_ID, compute_slot_mapping,
+                                           compute_slot_mapping_batch,
+                                           compute_slot_mapping_start_idx)
+
+
+@pytest.mark.parametrize("num_seqs", [1, 3, 8])
+@pytest.mark.parametrize("block_size", [16, 32])
+@pytest.mark.parametrize("is_prompt", [True, False])
+@pytest.mark.parametrize("sliding_window", [None, 20, 300])
+@pytest.mark.parametrize("max_seq_len", [64, 1024])
+@pytest.mark.parametrize("use_numpy_kernel", [True, False])
+@pytest.mark.parametrize("use_array", [True, False])
+def test_compute_slot_mapping_batch(monkeypatch: pytest.MonkeyPatch,
+                                    num_seqs: int, block_size: int,
+                                    is_prompt: bool,
+                                    sliding_window: Optional[int],
+                                    max_seq_len: int, use_numpy_kernel: bool,
+                                    use_array: bool):
+    if use_numpy_kernel:
+        monkeypatch.setattr(utils, "_compute_slot_mapping_batch_kernel",
+                            utils._compute_slot_mapping_batch_numpy)
+    random.seed(0)
+    seq_ids = list(range(num_seqs))
+    seq_lens = [random.randint(1, max_seq_len) for _ in seq_ids]
+    context_lens = [random.randint(0, seq_len - 1) for seq_len in seq_lens]
+    block_tables = {
+        seq_id: random.sample(range(10000), -(-seq_len // block_size))
+        for seq_id, seq_len in zip(seq_ids, seq_lens)
+    }
+    start_idxs = [
+        compute_slot_mapping_start_idx(is_prompt, seq_len - context_len,
+                                       context_len, sliding_window)
+        for seq_len, context_len in zip(seq_lens, context_lens)
+    ]
+
+    expected: list[int] = []
+    for seq_id, seq_len, context_len, start_idx in zip(seq_ids, seq_lens,
+                                                       context_lens,
+                                                       start_idxs):
+        compute_slot_mapping(False, expected, seq_id, seq_len, context_len,
+                             start_idx, block_size, block_tables)
+
+    actual: Union[list[int], array] = array("i") if use_array else []
+    compute_slot_mapping_batch(actual,
+                               [block_tables[seq_id] for seq_id in seq_ids],
+                               seq_lens, context_lens, start_idxs, block_size)
+    assert list(actual) == [int(slot) for slot in expected]
+
+
+@pytest.mark.parametrize("seq_len", [5, 300])
+def test_compute_slot_mapping_batch_profile_run(seq_len: int):
+    slot_mapping: list[int] = []
+    compute_slot_mapping_batch(slot_mapping, [None, None], [seq_len, 7],
+                               [0, 0], [0, 0], 16)
+    assert slot_mapping == [PAD_SLOT_ID] * (seq_len + 7)
@@ -6,15 +6,17 @@ import socket
 from collections.abc import AsyncIterator
 from unittest.mock import patch
 
+import numpy as np
 import pytest
 import torch
 from vllm_test_utils import monitor
 
 from vllm.config import ParallelConfig, VllmConfig, set_current_vllm_config
 from vllm.utils import (FlexibleArgumentParser, MemorySnapshot,
-                        PlaceholderModule, StoreBoolean, bind_kv_cache,
-                        deprecate_kwargs, get_open_port, memory_profiling,
-                        merge_async_iterators, supports_kw, swap_dict_values)
+                        PlaceholderModule, StoreBoolean, async_tensors_h2d,
+                        bind_kv_cache, deprecate_kwargs, get_open_port,
+                        memory_profiling, merge_async_iterators, supports_kw,
+                        swap_dict_values)
 
 from .utils import create_new_process_for_each_test, error_on_warning
 
@@ -476,3 +478,12 @@ def test_swap_dict_values(obj, key1, key2):
         assert obj[key1] == original_obj[key2]
     else:
         assert key1 not in obj
+
+
+def test_async_tensors_h2d():
+    data = [[1, 2, 3], [], np.array([4, 5], dtype=np.int64), [6]]
+    tensors = async_tensors_h2d(data, torch.int32, "cpu", pin_memory=False)
+    assert len(tensors) == len(data)
+    for tensor, expected in zip(tensors, data):
+        assert tensor.dtype == torch.int32
+        assert tensor.tolist() == list(expected)
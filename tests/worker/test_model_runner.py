@@ -289,6 +289,52 @@ def test_empty_seq_group():
     assert return_seq_lens is None
 
 
+@pytest.mark.parametrize("decode_query_lens,enforce_eager,uniform", [
+    ([1, 1, 1], True, False),
+    ([3, 3, 3], True, True),
+    ([1, 3, 2], True, False),
+    ([3, 3, 3], False, False),
+])
+def test_prepare_decode_query_lens_uniform(decode_query_lens, enforce_eager,
+                                           uniform):
+    model_runner = _create_model_runner(
+        "facebook/opt-125m",
+        seed=0,
+        dtype="float16",
+        enforce_eager=enforce_eager,
+        max_num_batched_tokens=100000,
+        max_num_seqs=100000,
+        enable_chunked_prefill=False,
+    )
+    if model_runner.attn_backend.get_name() != "FLASH_ATTN":
+        pytest.skip("decode_query_lens_uniform is set by FlashAttention only")
+
+    seq_group_metadata_list: list[SequenceGroupMetadata] = []
+    for i, query_len in enumerate(decode_query_lens):
+        # make sure all tokens fit into one block
+        context_len = i % (model_runner.block_size - query_len) + 1
+        seq_data = SequenceData.from_seqs(range(context_len))
+        seq_data.update_num_computed_tokens(context_len)
+        # Append the tokens to score in this decode step.
+        for _ in range(query_len):
+            seq_data.append_token_id(1, 0)
+        seq_group_metadata = SequenceGroupMetadata(
+            request_id=f"test_{i}",
+            is_prompt=False,
+            seq_data={0: seq_data},
+            sampling_params=SamplingParams(temperature=0),
+            block_tables={0: [1]},
+        )
+        seq_group_metadata_list.append(seq_group_metadata)
+
+    attn_metadata = model_runner._prepare_model_input_tensors(
+        seq_group_metadata_list).attn_metadata
+    assert attn_metadata.num_prefills == 0
+    assert attn_metadata.use_cuda_graph is not enforce_eager
+    assert attn_metadata.decode_query_lens_uniform is uniform
+    assert attn_metadata.decode_metadata.decode_query_lens_uniform is uniform
+
+
 @pytest.fixture
 def distributed_init():
     init_distributed_environment(
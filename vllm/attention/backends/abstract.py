@@ -143,6 +143,13 @@ class AttentionMetadata:
         attention."""
         pass
 
+    def reset_cached_metadata(self) -> None:
+        """Drop the cached prefill and decode metadata, so that they are
+        rebuilt from this metadata after it is updated in place (e.g. by the
+        multi-step worker)."""
+        self._cached_prefill_metadata = None
+        self._cached_decode_metadata = None
+
     def asdict_zerocopy(self,
                         skip_fields: Optional[Set[str]] = None
                         ) -> Dict[str, Any]:
@@ -1,12 +1,14 @@
 # SPDX-License-Identifier: Apache-2.0
 """Attention layer with FlashAttention."""
-from collections import defaultdict
+from array import array
 from dataclasses import dataclass
-from itertools import accumulate
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Type
+from functools import cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple, Type
 
+import numpy as np
 import torch
 
+import vllm.envs as envs
 from vllm import _custom_ops as ops
 # yapf conflicts with isort for this block
 # yapf: disable
@@ -18,14 +20,15 @@ from vllm.attention.backends.abstract import (AttentionBackend, AttentionImpl,
                                               is_quantized_kv_cache)
 # yapf: enable
 from vllm.attention.backends.utils import (
-    PAD_SLOT_ID, CommonAttentionState, compute_slot_mapping,
+    PAD_SLOT_ID, CommonAttentionState, compute_slot_mapping_batch,
     compute_slot_mapping_start_idx, get_num_prefill_decode_query_kv_tokens,
     get_seq_len_block_table_args, is_all_cross_attn_metadata_set,
     is_all_encoder_attn_metadata_set, is_block_tables_empty)
 from vllm.fa_utils import get_flash_attn_version
 from vllm.logger import init_logger
 from vllm.multimodal import MultiModalPlaceholderMap
-from vllm.utils import async_tensor_h2d, make_tensor_with_pad
+from vllm.platforms import current_platform
+from vllm.utils import async_tensors_h2d
 from vllm.vllm_flash_attn import (flash_attn_varlen_func,
                                   flash_attn_with_kvcache)
 
@@ -35,6 +38,14 @@ if TYPE_CHECKING:
 
 logger = init_logger(__name__)
 
+# Validate the metadata in advance_step.
+_DEBUG_ATTN = envs.VLLM_DEBUG_ATTN
+
+_SUPPORTED_HEAD_SIZES = (32, 64, 96, 128, 160, 192, 224, 256)
+
+# The slot mapping is copied to the device as int32.
+_MAX_INT32_SLOTS = 2**31 - 1
+
 
 class FlashAttentionBackend(AttentionBackend):
 
@@ -42,7 +53,7 @@ class FlashAttentionBackend(AttentionBackend):
 
     @staticmethod
     def get_supported_head_sizes() -> List[int]:
-        return [32, 64, 96, 128, 160, 192, 224, 256]
+        return list(_SUPPORTED_HEAD_SIZES)
 
     @staticmethod
     def get_name() -> str:
@@ -65,6 +76,7 @@ class FlashAttentionBackend(AttentionBackend):
         return CommonAttentionState
 
     @staticmethod
+    @cache
     def get_kv_cache_shape(
         num_blocks: int,
         block_size: int,
@@ -151,6 +163,9 @@ class FlashAttentionMetadata(AttentionMetadata):
 
     # Max number of query tokens among request in the batch.
     max_decode_query_len: Optional[int] = None
+    # Whether all decodes have the same query length greater than 1, e.g.
+    # speculative decoding with a fixed number of draft tokens.
+    decode_query_lens_uniform: bool = False
 
     # (batch_size + 1,). The cumulative subquery lengths of the sequences in
     # the batch, used to index into subquery. E.g., if the subquery length
@@ -160,9 +175,20 @@ class FlashAttentionMetadata(AttentionMetadata):
     # the batch, used to index into sequence. E.g., if the sequence length is
     # [4, 6], it is [0, 4, 10].
     seq_start_loc: Optional[torch.Tensor] = None
+    # (num_decodes + 1,). query_start_loc of the decodes of a mixed batch,
+    # rebased to start at 0. Precomputed by the builder, None otherwise.
+    _decode_query_start_loc: Optional[torch.Tensor] = None
 
     _cached_prefill_metadata: Optional["FlashAttentionMetadata"] = None
     _cached_decode_metadata: Optional["FlashAttentionMetadata"] = None
+    _cached_prefill_decode_metadata: Optional[
+        Tuple[Optional["FlashAttentionMetadata"],
+              Optional["FlashAttentionMetadata"]]] = None
+    # Per attention type, the query/key sequence metadata of the prefills and
+    # the sequence length/block table args of the decodes. Resolved by the
+    # first layer of each type and reused by the others.
+    _cached_query_key_seq_metadata: Optional[Dict[str, tuple]] = None
+    _cached_seq_len_block_table_args: Optional[Dict[str, tuple]] = None
 
     # Begin encoder attn & enc/dec cross-attn fields...
 
@@ -199,14 +225,44 @@ class FlashAttentionMetadata(AttentionMetadata):
         '''
         return is_all_cross_attn_metadata_set(self)
 
+    def asdict_zerocopy(self,
+                        skip_fields: Optional[Set[str]] = None
+                        ) -> Dict[str, Any]:
+        if skip_fields is None:
+            skip_fields = set()
+        # The cached prefill/decode metadata (and the decode query start
+        # locations) is derived from the other fields and is rebuilt on the
+        # receiving side, so it is not broadcasted.
+        skip_fields.add('_decode_query_start_loc')
+        skip_fields.add('_cached_prefill_metadata')
+        skip_fields.add('_cached_decode_metadata')
+        skip_fields.add('_cached_prefill_decode_metadata')
+        skip_fields.add('_cached_query_key_seq_metadata')
+        skip_fields.add('_cached_seq_len_block_table_args')
+        return super().asdict_zerocopy(skip_fields)
+
+    @property
+    def prefill_decode_metadata(
+        self
+    ) -> Tuple[Optional["FlashAttentionMetadata"],
+               Optional["FlashAttentionMetadata"]]:
+        """The prefill and decode metadata, resolved once per batch so that
+        each attention layer only does a single attribute lookup."""
+        if self._cached_prefill_decode_metadata is None:
+            self._cached_prefill_decode_metadata = (self.prefill_metadata,
+                                                    self.decode_metadata)
+        return self._cached_prefill_decode_metadata
+
     @property
     def prefill_metadata(self) -> Optional["FlashAttentionMetadata"]:
         if self.num_prefills == 0:
             return None
 
-        if self._cached_prefill_metadata is not None:
-            return self._cached_prefill_metadata
+        if self._cached_prefill_metadata is None:
+            self._cached_prefill_metadata = self._build_prefill_metadata()
+        return self._cached_prefill_metadata
 
+    def _build_prefill_metadata(self) -> "FlashAttentionMetadata":
         assert ((self.seq_lens is not None)
                 or (self.encoder_seq_lens is not None))
         assert ((self.seq_lens_tensor is not None)
@@ -228,41 +284,30 @@ class FlashAttentionMetadata(AttentionMetadata):
         block_tables = (None if self.block_tables is None else
                         self.block_tables[:self.num_prefills])
 
-        self._cached_prefill_metadata = FlashAttentionMetadata(
-            num_prefills=self.num_prefills,
-            num_prefill_tokens=self.num_prefill_tokens,
-            num_decode_tokens=0,
-            slot_mapping=slot_mapping,
-            multi_modal_placeholder_index_maps=self.
-            multi_modal_placeholder_index_maps,
-            enable_kv_scales_calculation=self.enable_kv_scales_calculation,
-            seq_lens=seq_lens,
-            seq_lens_tensor=seq_lens_tensor,
-            max_query_len=self.max_query_len,
-            max_prefill_seq_len=self.max_prefill_seq_len,
-            max_decode_query_len=0,
-            max_decode_seq_len=0,
-            query_start_loc=query_start_loc,
-            seq_start_loc=seq_start_loc,
-            context_lens_tensor=context_lens_tensor,
-            block_tables=block_tables,
-            use_cuda_graph=False,
-            # Begin encoder & cross attn fields below...
-            encoder_seq_lens=self.encoder_seq_lens,
-            encoder_seq_lens_tensor=self.encoder_seq_lens_tensor,
-            encoder_seq_start_loc=self.encoder_seq_start_loc,
-            max_encoder_seq_len=self.max_encoder_seq_len,
-            cross_slot_mapping=self.cross_slot_mapping,
-            cross_block_tables=self.cross_block_tables)
-        return self._cached_prefill_metadata
+        prefill_metadata = self._bare_clone()
+        prefill_metadata.num_decode_tokens = 0
+        prefill_metadata.slot_mapping = slot_mapping
+        prefill_metadata.seq_lens = seq_lens
+        prefill_metadata.seq_lens_tensor = seq_lens_tensor
+        prefill_metadata.max_decode_query_len = 0
+        prefill_metadata.max_decode_seq_len = 0
+        prefill_metadata.query_start_loc = query_start_loc
+        prefill_metadata.seq_start_loc = seq_start_loc
+        prefill_metadata.context_lens_tensor = context_lens_tensor
+        prefill_metadata.block_tables = block_tables
+        prefill_metadata.use_cuda_graph = False
+        return prefill_metadata
 
     @property
     def decode_metadata(self) -> Optional["FlashAttentionMetadata"]:
         if self.num_decode_tokens == 0:
             return None
 
-        if self._cached_decode_metadata is not None:
-            return self._cached_decode_metadata
+        if self._cached_decode_metadata is None:
+            self._cached_decode_metadata = self._build_decode_metadata()
+        return self._cached_decode_metadata
+
+    def _build_decode_metadata(self) -> "FlashAttentionMetadata":
         assert ((self.seq_lens_tensor is not None)
                 or (self.encoder_seq_lens_tensor is not None))
 
@@ -273,39 +318,86 @@ class FlashAttentionMetadata(AttentionMetadata):
                            self.seq_lens_tensor[self.num_prefills:])
         block_tables = (None if self.block_tables is None else
                         self.block_tables[self.num_prefills:])
-
-        self._cached_decode_metadata = FlashAttentionMetadata(
-            num_prefills=0,
-            num_prefill_tokens=0,
-            num_decode_tokens=self.num_decode_tokens,
-            slot_mapping=slot_mapping,
-            multi_modal_placeholder_index_maps=None,
-            enable_kv_scales_calculation=True,
-            seq_lens=None,
-            seq_lens_tensor=seq_lens_tensor,
-            max_decode_query_len=self.max_decode_query_len,
-            max_query_len=self.max_query_len,
-            max_prefill_seq_len=0,
-            max_decode_seq_len=self.max_decode_seq_len,
-            # Batch may be composed of prefill|decodes, adjust query start
-            # indices to refer to the start of decodes. E.g.
-            # in tokens:[3 prefills|6 decodes], query_start_loc=[3,9] => [0,6].
-            query_start_loc=(self.query_start_loc[self.num_prefills:] -
-                             self.query_start_loc[self.num_prefills])
-            if self.query_start_loc is not None else None,
-            seq_start_loc=self.seq_start_loc[self.num_prefills:]
-            if self.seq_start_loc is not None else None,
-            context_lens_tensor=None,
-            block_tables=block_tables,
-            use_cuda_graph=self.use_cuda_graph,
-            # Begin encoder & cross attn fields below...
-            encoder_seq_lens=self.encoder_seq_lens,
-            encoder_seq_lens_tensor=self.encoder_seq_lens_tensor,
-            encoder_seq_start_loc=self.encoder_seq_start_loc,
-            max_encoder_seq_len=self.max_encoder_seq_len,
-            cross_slot_mapping=self.cross_slot_mapping,
-            cross_block_tables=self.cross_block_tables)
-        return self._cached_decode_metadata
+        # Batch may be composed of prefill|decodes, adjust query start
+        # indices to refer to the start of decodes. E.g.
+        # in tokens:[3 prefills|6 decodes], query_start_loc=[3,9] => [0,6].
+        if self.query_start_loc is None or self.num_prefills == 0:
+            query_start_loc = self.query_start_loc
+        elif self._decode_query_start_loc is not None:
+            query_start_loc = self._decode_query_start_loc
+        else:
+            query_start_loc = (self.query_start_loc[self.num_prefills:] -
+                               self.query_start_loc[self.num_prefills])
+        seq_start_loc = (None if self.seq_start_loc is None else
+                         self.seq_start_loc[self.num_prefills:])
+
+        decode_metadata = self._bare_clone()
+        decode_metadata.num_prefills = 0
+        decode_metadata.num_prefill_tokens = 0
+        decode_metadata.slot_mapping = slot_mapping
+        decode_metadata.multi_modal_placeholder_index_maps = None
+        decode_metadata.enable_kv_scales_calculation = True
+        decode_metadata.seq_lens = None
+        decode_metadata.seq_lens_tensor = seq_lens_tensor
+        decode_metadata.max_prefill_seq_len = 0
+        decode_metadata.query_start_loc = query_start_loc
+        decode_metadata.seq_start_loc = seq_start_loc
+        decode_metadata.context_lens_tensor = None
+        decode_metadata.block_tables = block_tables
+        return decode_metadata
+
+    def _bare_clone(self) -> "FlashAttentionMetadata":
+        """Shallow copy of this metadata that bypasses the dataclass
+        __init__, used to derive the prefill and decode metadata. The caller
+        overrides the fields that differ."""
+        clone = object.__new__(FlashAttentionMetadata)
+        clone.__dict__.update(self.__dict__)
+        clone.num_encoder_tokens = None
+        clone._decode_query_start_loc = None
+        clone.reset_cached_metadata()
+        return clone
+
+    def reset_cached_metadata(self) -> None:
+        """Also drops the cached (prefill, decode) pair and the per attention
+        type sequence args."""
+        self._cached_prefill_metadata = None
+        self._cached_decode_metadata = None
+        self._cached_prefill_decode_metadata = None
+        self._cached_query_key_seq_metadata = None
+        self._cached_seq_len_block_table_args = None
+
+    def query_key_seq_metadata(self, attn_type: str) -> tuple:
+        """_get_query_key_seq_metadata of this prefill metadata, cached per
+        attention type."""
+        if self._cached_query_key_seq_metadata is None:
+            self._cached_query_key_seq_metadata = {}
+        seq_metadata = self._cached_query_key_seq_metadata.get(attn_type)
+        if seq_metadata is None:
+            seq_metadata = _get_query_key_seq_metadata(self, True, attn_type)
+            self._cached_query_key_seq_metadata[attn_type] = seq_metadata
+        return seq_metadata
+
+    def seq_len_block_table_args(self, attn_type: str) -> tuple:
+        """get_seq_len_block_table_args of this decode metadata, cached per
+        attention type."""
+        if self._cached_seq_len_block_table_args is None:
+            self._cached_seq_len_block_table_args = {}
+        args = self._cached_seq_len_block_table_args.get(attn_type)
+        if args is None:
+            args = get_seq_len_block_table_args(self, False, attn_type)
+            self._cached_seq_len_block_table_args[attn_type] = args
+        return args
+
+    def _update_cached_metadata(self) -> None:
+        """Eagerly build the prefill and decode metadata, so that accessing
+        them from the attention layers is a plain attribute lookup instead of
+        slicing the batch tensors on every forward."""
+        self._cached_prefill_metadata = (self._build_prefill_metadata()
+                                         if self.num_prefills > 0 else None)
+        self._cached_decode_metadata = (self._build_decode_metadata() if
+                                        self.num_decode_tokens > 0 else None)
+        self._cached_prefill_decode_metadata = (self._cached_prefill_metadata,
+                                                self._cached_decode_metadata)
 
     def advance_step(self,
                      model_input: "ModelInputForGPUWithSamplingMetadata",
@@ -337,38 +429,44 @@ class FlashAttentionMetadata(AttentionMetadata):
             self.max_query_len = 1
 
             self.slot_mapping = self.slot_mapping[:num_seqs]
-        else:
-            assert self.seq_lens is not None
-            assert self.max_decode_seq_len == max(self.seq_lens)
 
-        assert self.num_prefills == 0
-        assert self.num_prefill_tokens == 0
-        assert self.num_decode_tokens == num_seqs
-        assert self.slot_mapping.shape == (num_seqs, )
+        if _DEBUG_ATTN:
+            assert self.num_prefills == 0
+            assert self.num_prefill_tokens == 0
+            assert self.num_decode_tokens == num_seqs
+            assert self.slot_mapping.shape == (num_seqs, )
 
-        assert self.seq_lens is not None
-        assert len(self.seq_lens) == num_seqs
-        assert self.seq_lens_tensor is not None
-        assert self.seq_lens_tensor.shape == (num_seqs, )
-        assert self.max_query_len == 1
-        assert self.max_prefill_seq_len == 0
+            assert self.seq_lens is not None
+            assert len(self.seq_lens) == num_seqs
+            assert self.seq_lens_tensor is not None
+            assert self.seq_lens_tensor.shape == (num_seqs, )
+            assert self.max_query_len == 1
+            assert self.max_prefill_seq_len == 0
 
-        assert self.query_start_loc is not None
-        assert self.query_start_loc.shape == (num_queries + 1, )
-        assert self.seq_start_loc is not None
-        assert self.seq_start_loc.shape == (num_seqs + 1, )
+            assert self.query_start_loc is not None
+            assert self.query_start_loc.shape == (num_queries + 1, )
+            assert self.seq_start_loc is not None
+            assert self.seq_start_loc.shape == (num_seqs + 1, )
 
-        assert self.context_lens_tensor is not None
-        assert self.context_lens_tensor.shape == (num_queries, )
+            assert self.context_lens_tensor is not None
+            assert self.context_lens_tensor.shape == (num_queries, )
 
-        assert self.block_tables is not None
-        assert self.block_tables.shape[0] == num_seqs
+            assert self.block_tables is not None
+            assert self.block_tables.shape[0] == num_seqs
 
         # Update query lengths. Note that we update only queries and not seqs,
-        # since tensors may be padded due to captured cuda graph batch size
-        for i in range(num_queries):
-            self.seq_lens[i] += 1
-        self.max_decode_seq_len = max(self.seq_lens)
+        # since tensors may be padded due to captured cuda graph batch size.
+        # The list is updated in place, since it is shared with the model
+        # input.
+        self.seq_lens[:num_queries] = [
+            seq_len + 1 for seq_len in self.seq_lens[:num_queries]
+        ]
+        if turn_prefills_into_decodes:
+            # max_decode_seq_len did not account for the former prefills.
+            self.max_decode_seq_len = max(self.seq_lens)
+        else:
+            # Every decode grows by exactly one token.
+            self.max_decode_seq_len += 1
 
         ops.advance_step_flashattn(num_seqs=num_seqs,
                                    num_queries=num_queries,
@@ -380,6 +478,10 @@ class FlashAttentionMetadata(AttentionMetadata):
                                    slot_mapping=self.slot_mapping,
                                    block_tables=self.block_tables)
 
+        # The batch composition and max_decode_seq_len changed in place, so
+        # the cached prefill/decode metadata is stale.
+        self._update_cached_metadata()
+
 
 class FlashAttentionMetadataBuilder(
         AttentionMetadataBuilder[FlashAttentionMetadata]):
@@ -389,16 +491,33 @@ class FlashAttentionMetadataBuilder(
         self.runner = input_builder.runner
         self.sliding_window = input_builder.sliding_window
         self.block_size = input_builder.block_size
+        # The encoder/decoder runner sets the encoder and cross-attention
+        # fields after build(), so the prefill/decode metadata of those
+        # models must be derived lazily, once the fields are set.
+        self.is_encoder_decoder = self.runner.model_config.is_encoder_decoder
+
+        # Persistent (pinned) host staging buffer for the cuda graph block
+        # tables, allocated on first use. It is reused across steps, so the
+        # event guards against overwriting it while the non-blocking copy of
+        # the previous step is still in flight.
+        self._graph_block_tables_cpu: Optional[torch.Tensor] = None
+        self._graph_block_tables_copied: Optional[torch.cuda.Event] = None
 
     def prepare(self):
-        self.slot_mapping: List[int] = []
-        self.prefill_seq_lens: List[int] = []
-        self.context_lens: List[int] = []
+        # The integer metadata is accumulated in int32 arrays, which are
+        # copied into the pinned host buffer at C speed in build().
+        self.slot_mapping = array("i")
+        self.prefill_seq_lens = array("i")
+        self.context_lens = array("i")
         self.block_tables: List[List[int]] = []
-        self.curr_seq_lens: List[int] = []
-        self.multimodal_placeholder_maps: Dict[
-            str,
-            MultiModalPlaceholderMap] = defaultdict(MultiModalPlaceholderMap)
+        self.curr_seq_lens = array("i")
+        # Per-sequence inputs of the slot mapping, which is computed for
+        # the whole batch at once in build().
+        self.slot_mapping_block_tables: List[Optional[List[int]]] = []
+        self.slot_mapping_seq_lens: List[int] = []
+        self.slot_mapping_start_idxs: List[int] = []
+        self.multimodal_placeholder_maps: Dict[str,
+                                               MultiModalPlaceholderMap] = {}
         self.num_prefills = 0
         self.num_prefill_tokens = 0
         self.num_decode_tokens = 0
@@ -410,33 +529,38 @@ class FlashAttentionMetadataBuilder(
         """Add a sequence group to the metadata. Specifically update/append
         1. context length.
         2. block table.
-        3. slot mapping.
+        3. slot mapping inputs.
         """
         is_prompt = inter_data.is_prompt
         block_tables = inter_data.block_tables
-
-        for (seq_id, token_len, seq_len, curr_seq_len, query_len, context_len,
-             curr_sliding_window_block) in zip(
-                 inter_data.seq_ids, [len(t) for t in inter_data.input_tokens],
-                 inter_data.orig_seq_lens, inter_data.seq_lens,
-                 inter_data.query_lens, inter_data.context_lens,
-                 inter_data.curr_sliding_window_blocks):
-            self.context_lens.append(context_len)
-
-            if is_prompt:
-                mm_maps = inter_data.multi_modal_placeholder_maps
-                if mm_maps:
+        seq_ids = inter_data.seq_ids
+        num_seqs = len(seq_ids)
+        seq_lens = inter_data.orig_seq_lens[:num_seqs]
+        query_lens = inter_data.query_lens[:num_seqs]
+        context_lens = inter_data.context_lens[:num_seqs]
+
+        # The per-sequence lengths are accumulated for the whole sequence
+        # group at once rather than one sequence at a time.
+        self.context_lens.extend(context_lens)
+        if is_prompt:
+            mm_maps = inter_data.multi_modal_placeholder_maps
+            if mm_maps:
+                for _ in range(num_seqs):
                     for modality, placeholders in mm_maps.items():
-                        self.multimodal_placeholder_maps[modality].extend(
-                            placeholders)
-
-                self.num_prefills += 1
-                self.num_prefill_tokens += token_len
-                self.prefill_seq_lens.append(seq_len)
-            else:
-                self.num_decode_tokens += query_len
-                self.curr_seq_lens.append(curr_seq_len)
+                        self.multimodal_placeholder_maps.setdefault(
+                            modality,
+                            MultiModalPlaceholderMap()).extend(placeholders)
+
+            self.num_prefills += num_seqs
+            self.num_prefill_tokens += sum(
+                map(len, inter_data.input_tokens[:num_seqs]))
+            self.prefill_seq_lens.extend(seq_lens)
+        else:
+            self.num_decode_tokens += sum(query_lens)
+            self.curr_seq_lens.extend(inter_data.seq_lens[:num_seqs])
 
+        for seq_id, curr_sliding_window_block in zip(
+                seq_ids, inter_data.curr_sliding_window_blocks):
             # Compute block table.
             # TODO(sang): Combine chunked prefill and prefix caching by
             # only allowing multiple of block_size chunk size.
@@ -455,14 +579,17 @@ class FlashAttentionMetadataBuilder(
                         -curr_sliding_window_block:]
             self.block_tables.append(block_table)
 
-            # Compute slot mapping.
-            is_profile_run = is_block_tables_empty(block_tables)
-            start_idx = compute_slot_mapping_start_idx(is_prompt, query_len,
-                                                       context_len,
-                                                       self.sliding_window)
-            compute_slot_mapping(is_profile_run, self.slot_mapping, seq_id,
-                                 seq_len, context_len, start_idx,
-                                 self.block_size, inter_data.block_tables)
+        # Gather the inputs of the slot mapping.
+        if is_block_tables_empty(block_tables):
+            self.slot_mapping_block_tables.extend([None] * num_seqs)
+        else:
+            self.slot_mapping_block_tables.extend(block_tables[seq_id]
+                                                  for seq_id in seq_ids)
+        self.slot_mapping_seq_lens.extend(seq_lens)
+        self.slot_mapping_start_idxs.extend(
+            compute_slot_mapping_start_idx(is_prompt, query_len, context_len,
+                                           self.sliding_window)
+            for query_len, context_len in zip(query_lens, context_lens))
 
     def _get_graph_runner_block_tables(
             self, num_seqs: int,
@@ -472,7 +599,17 @@ class FlashAttentionMetadataBuilder(
         max_batch_size, max_blocks = self.runner.graph_block_tables.shape
         assert max_batch_size >= num_seqs
 
-        graph_block_tables = self.runner.graph_block_tables[:num_seqs]
+        if self._graph_block_tables_cpu is None:
+            self._graph_block_tables_cpu = torch.from_numpy(
+                self.runner.graph_block_tables)
+            if self.runner.pin_memory:
+                self._graph_block_tables_cpu = \
+                    self._graph_block_tables_cpu.pin_memory()
+                self._graph_block_tables_copied = torch.cuda.Event()
+        elif self._graph_block_tables_copied is not None:
+            self._graph_block_tables_copied.synchronize()
+
+        graph_block_tables = self._graph_block_tables_cpu.numpy()[:num_seqs]
         for i, block_table in enumerate(block_tables):
             if block_table:
                 num_blocks = len(block_table)
@@ -485,8 +622,11 @@ class FlashAttentionMetadataBuilder(
                     graph_block_tables[
                         i, :max_blocks] = block_table[:max_blocks]
 
-        return torch.from_numpy(graph_block_tables).to(
+        block_tables_tensor = self._graph_block_tables_cpu[:num_seqs].to(
             device=self.runner.device, non_blocking=True)
+        if self._graph_block_tables_copied is not None:
+            self._graph_block_tables_copied.record()
+        return block_tables_tensor
 
     def build(self, seq_lens: List[int], query_lens: List[int],
               cuda_graph_pad_size: int, batch_size: int):
@@ -499,65 +639,113 @@ class FlashAttentionMetadataBuilder(
                                  -1 if cuda graph is not used.
             batch_size: The maybe padded batch size.
         """
-        prefix_cache_hit = any([
-            inter_data.prefix_cache_hit
-            for inter_data in self.input_builder.inter_data_list
-        ])
-        for inter_data in self.input_builder.inter_data_list:
+        inter_data_list = self.input_builder.inter_data_list
+        # Prefix cache hits only happen for prompts, so decode-only batches
+        # (the steady state of generation) skip the scan.
+        is_decode_only = not any(inter_data.is_prompt
+                                 for inter_data in inter_data_list)
+        prefix_cache_hit = not is_decode_only and any(
+            inter_data.prefix_cache_hit for inter_data in inter_data_list)
+        for inter_data in inter_data_list:
             self._add_seq_group(inter_data,
                                 self.input_builder.chunked_prefill_enabled,
                                 prefix_cache_hit)
+        compute_slot_mapping_batch(self.slot_mapping,
+                                   self.slot_mapping_block_tables,
+                                   self.slot_mapping_seq_lens,
+                                   self.context_lens,
+                                   self.slot_mapping_start_idxs,
+                                   self.block_size)
 
         device = self.runner.device
         use_captured_graph = cuda_graph_pad_size != -1
 
         max_query_len = max(query_lens)
-        decode_query_lens = query_lens[self.num_prefills:]
-        if len(decode_query_lens) > 0:
-            max_decode_query_len = max(decode_query_lens)
+        if is_decode_only:
+            # Decode-only batch, no need to slice the query lengths.
+            max_decode_query_len = max_query_len
+            max_prefill_seq_len = 0
         else:
-            max_decode_query_len = 1
-        max_prefill_seq_len = max(self.prefill_seq_lens, default=0)
+            max_decode_query_len = max(query_lens[self.num_prefills:],
+                                       default=1)
+            max_prefill_seq_len = max(self.prefill_seq_lens, default=0)
         max_decode_seq_len = max(self.curr_seq_lens, default=0)
+        # Whether all decodes have the same query length greater than 1, in
+        # which case they use the dense flash_attn_with_kvcache layout. Left
+        # off for CUDA graphs, which are captured with single-token decodes.
+        # The slice is only taken for multi-token decodes.
+        decode_query_lens_uniform = (
+            not use_captured_graph and max_decode_query_len > 1
+            and min(query_lens[self.num_prefills:]) == max_decode_query_len)
         num_decode_tokens = self.num_decode_tokens
-        query_start_loc = list(accumulate(query_lens, initial=0))
-        seq_start_loc = list(accumulate(seq_lens, initial=0))
+        if is_decode_only and max_query_len == 1:
+            # Every sequence has exactly one query token.
+            query_start_loc = np.arange(len(query_lens) + 1, dtype=np.int32)
+        else:
+            query_start_loc = np.zeros(len(query_lens) + 1, dtype=np.int32)
+            np.cumsum(query_lens, dtype=np.int32, out=query_start_loc[1:])
+        seq_start_loc = np.zeros(len(seq_lens) + 1, dtype=np.int32)
+        np.cumsum(seq_lens, dtype=np.int32, out=seq_start_loc[1:])
 
         num_seqs = len(seq_lens)
         if use_captured_graph:
-            self.slot_mapping.extend([PAD_SLOT_ID] * cuda_graph_pad_size)
-            self.block_tables.extend([] * cuda_graph_pad_size)
+            if cuda_graph_pad_size > 0:
+                self.slot_mapping.extend(
+                    array("i", [PAD_SLOT_ID]) * cuda_graph_pad_size)
             num_decode_tokens = batch_size - self.num_prefill_tokens
             block_tables = self._get_graph_runner_block_tables(
                 num_seqs, self.block_tables)
         else:
-            block_tables = make_tensor_with_pad(
-                self.block_tables,
-                pad=0,
-                dtype=torch.int,
-                device=device,
-            )
+            # Stage the padded block tables in a (pinned) host buffer through
+            # its numpy view, and copy it to the device without blocking.
+            max_blocks = max(map(len, self.block_tables), default=0)
+            block_tables_cpu = torch.zeros(
+                (len(self.block_tables), max_blocks),
+                dtype=torch.int32,
+                pin_memory=self.runner.pin_memory)
+            block_tables_np = block_tables_cpu.numpy()
+            for i, block_table in enumerate(self.block_tables):
+                if block_table:
+                    block_tables_np[i, :len(block_table)] = block_table
+            block_tables = block_tables_cpu.to(device=device,
+                                               non_blocking=True)
         assert max_query_len > 0, ("query_lens: {}".format(query_lens))
 
         assert device is not None
-        context_lens_tensor = async_tensor_h2d(self.context_lens, torch.int,
-                                               device, self.runner.pin_memory)
-        seq_lens_tensor = async_tensor_h2d(seq_lens, torch.int, device,
-                                           self.runner.pin_memory)
-        slot_mapping_tensor = async_tensor_h2d(self.slot_mapping, torch.long,
-                                               device, self.runner.pin_memory)
-        query_start_loc_tensor = async_tensor_h2d(query_start_loc, torch.int32,
-                                                  device,
-                                                  self.runner.pin_memory)
-        seq_start_loc_tensor = async_tensor_h2d(seq_start_loc, torch.int32,
-                                                device, self.runner.pin_memory)
+        # All the int32 metadata is copied to the device with one transfer.
+        # The slot mapping is transferred as int32 as well and only widened
+        # on the device, since the cache kernels index slots with int64.
+        num_gpu_blocks = self.runner.cache_config.num_gpu_blocks
+        assert (num_gpu_blocks is None
+                or num_gpu_blocks * self.block_size <= _MAX_INT32_SLOTS), (
+                    "The KV cache has too many slots for an int32 slot "
+                    "mapping.")
+        h2d_data = [
+            self.context_lens, seq_lens, query_start_loc, seq_start_loc,
+            self.slot_mapping
+        ]
+        # The query start locations of the decodes of a mixed batch are
+        # rebased on the host, instead of on the device when building the
+        # decode metadata.
+        has_mixed_batch = 0 < self.num_prefills < len(query_lens)
+        if has_mixed_batch:
+            h2d_data.append(query_start_loc[self.num_prefills:] -
+                            query_start_loc[self.num_prefills])
+        h2d_tensors = async_tensors_h2d(h2d_data, torch.int32, device,
+                                        self.runner.pin_memory)
+        (context_lens_tensor, seq_lens_tensor, query_start_loc_tensor,
+         seq_start_loc_tensor, slot_mapping_tensor) = h2d_tensors[:5]
+        decode_query_start_loc_tensor = (h2d_tensors[5]
+                                         if has_mixed_batch else None)
+        slot_mapping_tensor = slot_mapping_tensor.long()
+        # Most batches have no multi-modal inputs at all.
         placeholder_index_maps = {
             modality: placeholder_map.index_map()
             for modality, placeholder_map in
             self.multimodal_placeholder_maps.items()
-        }
+        } if self.multimodal_placeholder_maps else None
 
-        return FlashAttentionMetadata(
+        metadata = FlashAttentionMetadata(
             num_prefills=self.num_prefills,
             slot_mapping=slot_mapping_tensor,
             num_prefill_tokens=self.num_prefill_tokens,
@@ -568,6 +756,7 @@ class FlashAttentionMetadataBuilder(
             seq_lens_tensor=seq_lens_tensor,
             max_query_len=max_query_len,
             max_decode_query_len=max_decode_query_len,
+            decode_query_lens_uniform=decode_query_lens_uniform,
             max_prefill_seq_len=max_prefill_seq_len,
             max_decode_seq_len=max_decode_seq_len,
             query_start_loc=query_start_loc_tensor,
@@ -575,7 +764,11 @@ class FlashAttentionMetadataBuilder(
             context_lens_tensor=context_lens_tensor,
             block_tables=block_tables,
             use_cuda_graph=use_captured_graph,
+            _decode_query_start_loc=decode_query_start_loc_tensor,
         )
+        if not self.is_encoder_decoder:
+            metadata._update_cached_metadata()
+        return metadata
 
 
 class FlashAttentionImpl(AttentionImpl):
@@ -630,6 +823,7 @@ class FlashAttentionImpl(AttentionImpl):
         self.sliding_window = ((sliding_window - 1,
                                 0) if sliding_window is not None else (-1, -1))
         self.kv_cache_dtype = kv_cache_dtype
+        self.fp8_attention = kv_cache_dtype.startswith("fp8")
         self.vllm_flash_attn_version = get_flash_attn_version()
         if (is_quantized_kv_cache(self.kv_cache_dtype)
                 and self.vllm_flash_attn_version != 3):
@@ -649,6 +843,42 @@ class FlashAttentionImpl(AttentionImpl):
                 f"Head size {head_size} is not supported by FlashAttention. "
                 f"Supported head sizes are: {support_head_sizes}.")
         self.attn_type = attn_type
+        self.causal = _get_causal_option(attn_type)
+        # The attention type is fixed per layer, so the per-type checks of
+        # forward are resolved here.
+        self.uses_encoder_metadata = attn_type in (
+            AttentionType.ENCODER, AttentionType.ENCODER_DECODER)
+        self.updates_kv_cache = attn_type != AttentionType.ENCODER
+        # Resolved once, the torch.ops namespace lookup is not free on the
+        # per-layer forward path.
+        self._reshape_and_cache_flash = (
+            torch.ops._C_cache_ops.reshape_and_cache_flash)
+        # The expanded q/k/v descale views per number of sequences. The layer
+        # scales are only ever updated in place, so the views stay valid.
+        self._descales: Dict[int, Tuple[torch.Tensor, torch.Tensor,
+                                        torch.Tensor]] = {}
+
+    def _get_descales(
+        self,
+        layer: AttentionLayer,
+        num_seqs: int,
+    ) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor],
+               Optional[torch.Tensor]]:
+        """
+        Returns the q/k/v descale tensors expanded to
+        (num_seqs, num_kv_heads), or Nones when the inputs are not fp8 and
+        the kernel ignores the scales.
+        """
+        if not self.fp8_attention:
+            return None, None, None
+        descales = self._descales.get(num_seqs)
+        if descales is None:
+            descale_shape = (num_seqs, self.num_kv_heads)
+            descales = (layer._q_scale.expand(descale_shape),
+                        layer._k_scale.expand(descale_shape),
+                        layer._v_scale.expand(descale_shape))
+            self._descales[num_seqs] = descales
+        return descales
 
     def forward(
         self,
@@ -679,31 +909,38 @@ class FlashAttentionImpl(AttentionImpl):
         assert output is not None, "Output tensor must be provided."
 
         # NOTE(woosuk): FlashAttention2 does not support FP8 KV cache.
-        if self.vllm_flash_attn_version < 3 or output.dtype != torch.bfloat16:
+        # The k/v scales are only read for an fp8 KV cache, and the FA3 fp8
+        # kernels write a bfloat16 output.
+        if self.fp8_attention and (self.vllm_flash_attn_version < 3
+                                   or output.dtype != torch.bfloat16):
             assert (
                 layer._k_scale_float == 1.0 and layer._v_scale_float == 1.0), (
                     "key/v_scale is only supported in FlashAttention 3 with "
                     "base dtype bfloat16")
 
         attn_type = self.attn_type
-        if (attn_type == AttentionType.ENCODER
-                and (not attn_metadata.is_all_encoder_attn_metadata_set)):
-            raise AttributeError("Encoder attention requires setting "
-                                 "encoder metadata attributes.")
-        elif (attn_type == AttentionType.ENCODER_DECODER
-              and (not attn_metadata.is_all_cross_attn_metadata_set)):
-            raise AttributeError("Encoder/decoder cross-attention "
-                                 "requires setting cross-attention "
-                                 "metadata attributes.")
+        if self.uses_encoder_metadata:
+            if (attn_type == AttentionType.ENCODER
+                    and (not attn_metadata.is_all_encoder_attn_metadata_set)):
+                raise AttributeError("Encoder attention requires setting "
+                                     "encoder metadata attributes.")
+            elif (attn_type == AttentionType.ENCODER_DECODER
+                  and (not attn_metadata.is_all_cross_attn_metadata_set)):
+                raise AttributeError("Encoder/decoder cross-attention "
+                                     "requires setting cross-attention "
+                                     "metadata attributes.")
 
         kv_cache_dtype: str = self.kv_cache_dtype
         softmax_scale: float = self.scale
         window_size = self.sliding_window
         alibi_slopes: Optional[torch.Tensor] = self.alibi_slopes
         logits_soft_cap: Optional[float] = self.logits_soft_cap
-        fp8_attention = kv_cache_dtype.startswith("fp8")
+        fp8_attention = self.fp8_attention
+        # The KV cache is an empty tensor during the memory profiling run.
+        # numel() only reads the tensor metadata, so this needs no sync.
+        has_kv_cache = kv_cache.numel() > 0
 
-        if kv_cache.numel() > 0:
+        if has_kv_cache:
             key_cache = kv_cache[0]
             value_cache = kv_cache[1]
             # We skip updating the KV cache under two conditions:
@@ -713,84 +950,116 @@ class FlashAttentionImpl(AttentionImpl):
             #     cross-attention computation in the decoding phase, where the
             #     KV cache is already populated with the cross-attention
             #     tensor. Thus, we skip cache updates during this time.
-            if (attn_type != AttentionType.ENCODER) and (key is not None) and (
+            if self.updates_kv_cache and (key is not None) and (
                     value is not None):
-                if attn_type == AttentionType.ENCODER_DECODER:
+                if self.uses_encoder_metadata:
                     # Update cross-attention KV cache (prefill-only)
                     updated_slot_mapping = attn_metadata.cross_slot_mapping
                 else:
                     # Update self-attention KV cache (prefill/decode)
                     updated_slot_mapping = attn_metadata.slot_mapping
+                # The slot mappings are built as 1D tensors, so they are
+                # passed to the cache op without flattening.
+                if _DEBUG_ATTN:
+                    assert updated_slot_mapping is not None
+                    assert updated_slot_mapping.dim() == 1
 
                 # Reshape the input keys and values and store them in the cache.
                 # If kv_cache is not provided, the new key and value tensors are
                 # not cached. This happens during the initial memory
                 # profiling run.
-                torch.ops._C_cache_ops.reshape_and_cache_flash(
+                self._reshape_and_cache_flash(
                     key,
                     value,
-                    kv_cache[0],
-                    kv_cache[1],
-                    updated_slot_mapping.flatten(),  # type: ignore[union-attr]
+                    key_cache,
+                    value_cache,
+                    updated_slot_mapping,
                     kv_cache_dtype,
                     layer._k_scale,
                     layer._v_scale,
                 )
 
-                if fp8_attention:
-                    kv_cache = kv_cache.view(torch.float8_e4m3fn)
-                    key_cache = key_cache.view(torch.float8_e4m3fn)
-                    value_cache = value_cache.view(torch.float8_e4m3fn)
+            # The cache is read as fp8 by every paged path, including the
+            # cross-attention decode steps that skip the cache update above.
+            # It stays allocated as uint8, which the cache op expects.
+            if fp8_attention:
+                key_cache = key_cache.view(torch.float8_e4m3fn)
+                value_cache = value_cache.view(torch.float8_e4m3fn)
 
         if fp8_attention:
-            num_tokens, num_heads, head_size = query.shape
-            query, _ = ops.scaled_fp8_quant(
-                query.reshape(
-                    (num_tokens, num_heads * head_size)).contiguous(),
-                layer._q_scale)
-            query = query.reshape((num_tokens, num_heads, head_size))
+            query = _static_fp8_quant(query, layer._q_scale)
+
+        if (self.vllm_flash_attn_version == 3 and has_kv_cache
+                and attn_type == AttentionType.DECODER
+                and attn_metadata.num_prefills > 0
+                and attn_metadata.num_decode_tokens > 0):
+            # Mixed chunked-prefill batch. The K/V of every sequence is in
+            # the paged cache at this point, so FA3's paged varlen kernel
+            # attends the prefills and decodes in a single call.
+            assert attn_metadata.query_start_loc is not None
+            assert attn_metadata.max_query_len is not None
+            assert (attn_metadata.block_tables is not None
+                    and attn_metadata.block_tables.numel() > 0)
+            q_descale, k_descale, v_descale = self._get_descales(
+                layer, attn_metadata.query_start_loc.shape[0] - 1)
+            flash_attn_varlen_func(
+                q=query,
+                k=key_cache,
+                v=value_cache,
+                cu_seqlens_q=attn_metadata.query_start_loc,
+                max_seqlen_q=attn_metadata.max_query_len,
+                seqused_k=attn_metadata.seq_lens_tensor,
+                max_seqlen_k=max(attn_metadata.max_prefill_seq_len,
+                                 attn_metadata.max_decode_seq_len),
+                softmax_scale=softmax_scale,
+                causal=True,
+                window_size=window_size,
+                alibi_slopes=alibi_slopes,
+                block_table=attn_metadata.block_tables,
+                softcap=logits_soft_cap,
+                out=output,
+                fa_version=self.vllm_flash_attn_version,
+                q_descale=q_descale,
+                k_descale=k_descale,
+                v_descale=v_descale,
+            )
+            return output
 
         (num_prefill_query_tokens, num_prefill_kv_tokens,
         num_decode_query_tokens) = \
             get_num_prefill_decode_query_kv_tokens(attn_metadata, attn_type)
-        decode_query = query[num_prefill_query_tokens:]
-        decode_output = output[num_prefill_query_tokens:]
-        # QKV for prefill.
-        query = query[:num_prefill_query_tokens]
-        prefill_output = output[:num_prefill_query_tokens]
-        assert query.shape[0] == num_prefill_query_tokens
-        assert decode_query.shape[0] == num_decode_query_tokens
-
-        if prefill_meta := attn_metadata.prefill_metadata:
+        if num_prefill_query_tokens == 0:
+            # Decode-only batch (the steady state of generation), nothing to
+            # split off.
+            decode_query = query
+            decode_output = output
+            if _DEBUG_ATTN:
+                assert decode_query.shape[0] == num_decode_query_tokens
+        else:
+            # QKV for prefill. split() checks the token counts add up.
+            split_sizes = [num_prefill_query_tokens, num_decode_query_tokens]
+            query, decode_query = query.split(split_sizes)
+            prefill_output, decode_output = output.split(split_sizes)
+
+        prefill_meta, decode_meta = attn_metadata.prefill_decode_metadata
+        if prefill_meta:
             # Prompt run.
-            if (kv_cache.numel() == 0 or prefill_meta.block_tables is None
+            if (not has_kv_cache or prefill_meta.block_tables is None
                     or prefill_meta.block_tables.numel() == 0):
                 # normal attention
                 # When block_tables are not filled, it means q and k are the
                 # prompt, and they have the same length.
                 q_seq_start_loc, q_seq_len, k_seq_start_loc, k_seq_len = \
-                    _get_query_key_seq_metadata(prefill_meta, True, attn_type)
+                    prefill_meta.query_key_seq_metadata(attn_type)
 
                 key = key[:num_prefill_kv_tokens]
                 value = value[:num_prefill_kv_tokens]
 
                 if fp8_attention:
-                    num_kv_tokens, num_kv_heads, head_size = key.shape
-
-                    key, _ = ops.scaled_fp8_quant(
-                        key.reshape((num_kv_tokens,
-                                     num_kv_heads * head_size)).contiguous(),
-                        layer._k_scale)
-                    key = key.reshape((num_kv_tokens, num_kv_heads, head_size))
-
-                    value, _ = ops.scaled_fp8_quant(
-                        value.reshape((num_kv_tokens,
-                                       num_kv_heads * head_size)).contiguous(),
-                        layer._v_scale)
-                    value = value.reshape(
-                        (num_kv_tokens, num_kv_heads, head_size))
-
-                descale_shape = (q_seq_start_loc.shape[0] - 1, key.shape[1])
+                    key, value = _fp8_quant_kv(key, value, layer)
+
+                q_descale, k_descale, v_descale = self._get_descales(
+                    layer, q_seq_start_loc.shape[0] - 1)
                 flash_attn_varlen_func(
                     q=query,
                     k=key,
@@ -800,25 +1069,25 @@ class FlashAttentionImpl(AttentionImpl):
                     max_seqlen_q=q_seq_len,
                     max_seqlen_k=k_seq_len,
                     softmax_scale=softmax_scale,
-                    causal=_get_causal_option(attn_type),
+                    causal=self.causal,
                     window_size=window_size,
                     alibi_slopes=alibi_slopes,
                     softcap=logits_soft_cap,
                     out=prefill_output,
                     fa_version=self.vllm_flash_attn_version,
-                    q_descale=layer._q_scale.expand(descale_shape),
-                    k_descale=layer._k_scale.expand(descale_shape),
-                    v_descale=layer._v_scale.expand(descale_shape),
+                    q_descale=q_descale,
+                    k_descale=k_descale,
+                    v_descale=v_descale,
                 )
             else:
                 # prefix-enabled attention
                 assert attn_type == AttentionType.DECODER, (
                     "Only decoder-only models support prefix caching")
-                assert prefill_meta.seq_lens is not None
                 assert prefill_meta.query_start_loc is not None
-                max_seq_len = max(prefill_meta.seq_lens)
-                descale_shape = (prefill_meta.query_start_loc.shape[0] - 1,
-                                 key.shape[1])
+                # Computed once by the builder rather than per layer.
+                max_seq_len = prefill_meta.max_prefill_seq_len
+                q_descale, k_descale, v_descale = self._get_descales(
+                    layer, prefill_meta.query_start_loc.shape[0] - 1)
                 flash_attn_varlen_func(  # noqa
                     q=query,
                     k=key_cache,
@@ -835,25 +1104,55 @@ class FlashAttentionImpl(AttentionImpl):
                     softcap=logits_soft_cap,
                     out=prefill_output,
                     fa_version=self.vllm_flash_attn_version,
-                    q_descale=layer._q_scale.expand(descale_shape),
-                    k_descale=layer._k_scale.expand(descale_shape),
-                    v_descale=layer._v_scale.expand(descale_shape),
+                    q_descale=q_descale,
+                    k_descale=k_descale,
+                    v_descale=v_descale,
                 )
 
-        if decode_meta := attn_metadata.decode_metadata:
+        if decode_meta:
             # Decoding run.
             # Use flash_attn_varlen_func kernel for speculative decoding
             # because different queries might have different lengths.
 
             assert decode_meta.max_decode_query_len is not None
+            if decode_meta.decode_query_lens_uniform:
+                # Multi-token decodes of the same length, e.g. a fixed number
+                # of draft tokens, use the dense flash_attn_with_kvcache
+                # layout instead of the varlen kernel.
+                assert attn_type == AttentionType.DECODER, (
+                    "Only decoder-only models support max_decode_query_len > 1"
+                )
+                decode_query_len = decode_meta.max_decode_query_len
+                num_decodes = num_decode_query_tokens // decode_query_len
+                q_descale, k_descale, v_descale = self._get_descales(
+                    layer, num_decodes)
+                flash_attn_with_kvcache(
+                    q=decode_query.view(num_decodes, decode_query_len,
+                                        *decode_query.shape[1:]),
+                    k_cache=key_cache,
+                    v_cache=value_cache,
+                    block_table=decode_meta.block_tables,
+                    cache_seqlens=decode_meta.seq_lens_tensor,
+                    softmax_scale=softmax_scale,
+                    causal=True,
+                    window_size=window_size,
+                    alibi_slopes=alibi_slopes,
+                    softcap=logits_soft_cap,
+                    out=decode_output.view(num_decodes, decode_query_len,
+                                           *decode_output.shape[1:]),
+                    fa_version=self.vllm_flash_attn_version,
+                    q_descale=q_descale,
+                    k_descale=k_descale,
+                    v_descale=v_descale,
+                )
             # use only for actual varlen decoding
-            if decode_meta.max_decode_query_len > 1:
+            elif decode_meta.max_decode_query_len > 1:
                 assert attn_type == AttentionType.DECODER, (
                     "Only decoder-only models support max_decode_query_len > 1"
                 )
                 assert decode_meta.query_start_loc is not None
-                descale_shape = (decode_meta.query_start_loc.shape[0] - 1,
-                                 key.shape[1])
+                q_descale, k_descale, v_descale = self._get_descales(
+                    layer, decode_meta.query_start_loc.shape[0] - 1)
                 flash_attn_varlen_func(
                     q=decode_query,
                     k=key_cache,
@@ -870,9 +1169,9 @@ class FlashAttentionImpl(AttentionImpl):
                     block_table=decode_meta.block_tables,
                     out=decode_output,
                     fa_version=self.vllm_flash_attn_version,
-                    q_descale=layer._q_scale.expand(descale_shape),
-                    k_descale=layer._k_scale.expand(descale_shape),
-                    v_descale=layer._v_scale.expand(descale_shape),
+                    q_descale=q_descale,
+                    k_descale=k_descale,
+                    v_descale=v_descale,
                 )
             else:
                 # Use flash_attn_with_kvcache for normal decoding.
@@ -880,8 +1179,9 @@ class FlashAttentionImpl(AttentionImpl):
                     seq_lens_arg,
                     _,
                     block_tables_arg,
-                ) = get_seq_len_block_table_args(decode_meta, False, attn_type)
-                descale_shape = (seq_lens_arg.shape[0], key_cache.shape[-2])
+                ) = decode_meta.seq_len_block_table_args(attn_type)
+                q_descale, k_descale, v_descale = self._get_descales(
+                    layer, seq_lens_arg.shape[0])
                 flash_attn_with_kvcache(
                     q=decode_query.unsqueeze(1),
                     k_cache=key_cache,
@@ -895,9 +1195,9 @@ class FlashAttentionImpl(AttentionImpl):
                     softcap=logits_soft_cap,
                     out=decode_output.unsqueeze(1),
                     fa_version=self.vllm_flash_attn_version,
-                    q_descale=layer._q_scale.expand(descale_shape),
-                    k_descale=layer._k_scale.expand(descale_shape),
-                    v_descale=layer._v_scale.expand(descale_shape),
+                    q_descale=q_descale,
+                    k_descale=k_descale,
+                    v_descale=v_descale,
                 )
         return output
 
@@ -967,6 +1267,39 @@ def _get_query_key_seq_metadata(
         raise AttributeError(f"Invalid attention type {str(attn_type)}")
 
 
+def _static_fp8_quant(x: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+    """
+    Quantize a [num_tokens, num_heads, head_size] tensor to fp8 with a
+    per-tensor scale.
+
+    Same as ops.scaled_fp8_quant with a static scale, but takes the 3D
+    tensor directly. The kernel launches one block per row of the last
+    dim, so the input is viewed as [num_tokens, num_heads * head_size] to
+    launch one block per token.
+    """
+    num_tokens, num_heads, head_size = x.shape
+    x = x.contiguous().view(num_tokens, num_heads * head_size)
+    output = torch.empty_like(x, dtype=current_platform.fp8_dtype())
+    torch.ops._C.static_scaled_fp8_quant(output, x, scale)
+    return output.view(num_tokens, num_heads, head_size)
+
+
+def _fp8_quant_kv(
+    key: torch.Tensor,
+    value: torch.Tensor,
+    layer: AttentionLayer,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Quantize the key and value tensors to fp8 with the per-layer k/v scales.
+
+    Only needed when attending over the raw key/value tensors; the paged
+    paths read the KV cache, which is already stored as fp8. K and V have
+    separate static scales, so they cannot share one quant launch.
+    """
+    return (_static_fp8_quant(key, layer._k_scale),
+            _static_fp8_quant(value, layer._v_scale))
+
+
 def _get_causal_option(attn_type: str) -> bool:
     """
     Determine whether the given attention type is suitable for causal 
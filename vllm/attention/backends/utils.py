@@ -1,9 +1,11 @@
 # SPDX-License-Identifier: Apache-2.0
 """Attention backend utils"""
+from array import array
 from collections import defaultdict
 from contextlib import contextmanager
 from itertools import accumulate
-from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Type, TypeVar, Union
+from typing import (TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Type,
+                    TypeVar, Union)
 
 import numpy as np
 import torch
@@ -31,6 +33,12 @@ PAD_SLOT_ID = -1
 # if we have at least this many elements. Could be tuned further.
 _COMPUTE_SLOT_MAPPING_NUMPY_NUMEL = 256
 
+try:
+    from numba import jit
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    _NUMBA_AVAILABLE = False
+
 if TYPE_CHECKING:
     from vllm.worker.model_runner import ModelInputForGPUBuilder
 
@@ -118,6 +126,131 @@ def compute_slot_mapping(is_profile_run: bool, slot_mapping: List[int],
                                     range_end, block_size)
 
 
+def _compute_slot_mapping_batch_numpy(
+        slots: np.ndarray, block_table_array: np.ndarray,
+        block_table_starts: np.ndarray, range_starts: np.ndarray,
+        range_ends: np.ndarray, padding_mask_lens: np.ndarray,
+        block_size: int):
+    num_slots = padding_mask_lens + range_ends - range_starts
+    # Token position of every output slot. The first `padding_mask_len`
+    # slots of each sequence are masked with PAD_SLOT_ID.
+    seq_idx = np.repeat(np.arange(len(num_slots)), num_slots)
+    slot_starts = np.cumsum(num_slots) - num_slots
+    offsets = np.arange(len(slots)) - slot_starts[seq_idx]
+    positions = range_starts[seq_idx] + offsets - padding_mask_lens[seq_idx]
+    valid = offsets >= padding_mask_lens[seq_idx]
+    seq_idx = seq_idx[valid]
+    positions = positions[valid]
+
+    slots.fill(PAD_SLOT_ID)
+    block_idx = block_table_starts[seq_idx] + positions // block_size
+    slots[valid] = (block_table_array[block_idx] * block_size +
+                    positions % block_size)
+
+
+def _compute_slot_mapping_batch_loop(
+        slots: np.ndarray, block_table_array: np.ndarray,
+        block_table_starts: np.ndarray, range_starts: np.ndarray,
+        range_ends: np.ndarray, padding_mask_lens: np.ndarray,
+        block_size: int):
+    i = 0
+    for seq_idx in range(range_starts.shape[0]):
+        for _ in range(padding_mask_lens[seq_idx]):
+            slots[i] = PAD_SLOT_ID
+            i += 1
+        block_table_start = block_table_starts[seq_idx]
+        for position in range(range_starts[seq_idx], range_ends[seq_idx]):
+            block_number = block_table_array[block_table_start +
+                                             position // block_size]
+            slots[i] = block_number * block_size + position % block_size
+            i += 1
+
+
+# The plain loop is only fast once compiled by numba. Without numba we
+# fall back to the vectorized numpy implementation.
+if _NUMBA_AVAILABLE:
+    _compute_slot_mapping_batch_kernel = jit(
+        nopython=True, cache=True,
+        boundscheck=False)(_compute_slot_mapping_batch_loop)
+else:
+    _compute_slot_mapping_batch_kernel = _compute_slot_mapping_batch_numpy
+
+
+def compute_slot_mapping_batch(slot_mapping: Union[List[int], array],
+                               block_tables: List[Optional[List[int]]],
+                               seq_lens: List[int], context_lens: List[int],
+                               start_idxs: List[int], block_size: int):
+    """
+    Compute slot mapping for a batch of sequences at once.
+
+    `block_tables` holds the block table of each sequence, or None for the
+    sequences of the memory profiling run, whose slots are all PAD_SLOT_ID.
+    The result is the same as calling `compute_slot_mapping` for each
+    sequence in turn, but large batches are computed by a single (numba
+    compiled, if available) kernel call.
+    """
+    seq_lens_array = np.array(seq_lens, dtype=np.int64)
+    context_lens_array = np.array(context_lens, dtype=np.int64)
+    start_idxs_array = np.array(start_idxs, dtype=np.int64)
+    is_profile_run = np.fromiter(
+        (block_table is None for block_table in block_tables),
+        dtype=bool,
+        count=len(block_tables))
+    # Mask all the tokens of the profiling run sequences.
+    start_idxs_array[is_profile_run] = seq_lens_array[is_profile_run]
+    context_lens_array[is_profile_run] = 0
+
+    range_starts = np.maximum(start_idxs_array, context_lens_array)
+    padding_mask_lens = np.maximum(0, start_idxs_array - context_lens_array)
+    num_slots = padding_mask_lens + seq_lens_array - range_starts
+    total_num_slots = int(num_slots.sum())
+
+    # The kernel will be faster than python if we have many elements,
+    # otherwise it will be slower.
+    if total_num_slots < _COMPUTE_SLOT_MAPPING_NUMPY_NUMEL:
+        for block_table, seq_len, context_len, start_idx in zip(
+                block_tables, seq_lens, context_lens, start_idxs):
+            if block_table is None:
+                slot_mapping.extend([PAD_SLOT_ID] * seq_len)
+                continue
+            padding_mask_len = max(0, start_idx - context_len)
+            slot_mapping.extend([PAD_SLOT_ID] * padding_mask_len)
+            _compute_slot_mapping_python(slot_mapping, block_table,
+                                         max(start_idx, context_len), seq_len,
+                                         block_size)
+        return
+
+    # Flatten the blocks covering the slot range of each sequence into one
+    # array, and remember where the block table of each of them would start.
+    # For decodes this is just the last block of each sequence.
+    first_blocks = range_starts // block_size
+    end_blocks = -(-seq_lens_array // block_size)
+    end_blocks[is_profile_run] = first_blocks[is_profile_run]
+    block_table_lens = end_blocks - first_blocks
+    seq_block_tables = [
+        block_table[first_block:end_block]
+        for block_table, first_block, end_block in zip(
+            block_tables, first_blocks.tolist(), end_blocks.tolist())
+        if block_table is not None
+    ]
+    block_table_starts = (np.cumsum(block_table_lens) - block_table_lens -
+                          first_blocks)
+    block_table_array = np.fromiter(
+        (block for block_table in seq_block_tables for block in block_table),
+        dtype=np.int64,
+        count=int(block_table_lens.sum()))
+
+    slots = np.empty(total_num_slots, dtype=np.int64)
+    _compute_slot_mapping_batch_kernel(slots, block_table_array,
+                                       block_table_starts, range_starts,
+                                       seq_lens_array, padding_mask_lens,
+                                       block_size)
+    if isinstance(slot_mapping, array):
+        slot_mapping.frombytes(slots.astype(slot_mapping.typecode).tobytes())
+    else:
+        slot_mapping.extend(slots.tolist())
+
+
 TAttentionMetadata = TypeVar("TAttentionMetadata", bound='AttentionMetadata')
 
 
@@ -95,6 +95,7 @@ if TYPE_CHECKING:
     VLLM_DP_MASTER_PORT: int = 0
     VLLM_MARLIN_USE_ATOMIC_ADD: bool = False
     VLLM_V0_USE_OUTLINES_CACHE: bool = False
+    VLLM_DEBUG_ATTN: bool = False
 
 
 def get_default_cache_root():
@@ -623,6 +624,13 @@ environment_variables: dict[str, Callable[[], Any]] = {
     # an environment with potentially malicious users.
     "VLLM_V0_USE_OUTLINES_CACHE":
     lambda: os.environ.get("VLLM_V0_USE_OUTLINES_CACHE", "0") == "1",
+
+    # If set, FlashAttention runs its hot-path consistency checks: the
+    # metadata validation on every multi-step update (advance_step) and the
+    # slot mapping and token count asserts in forward. Off by default as the
+    # checks run on every step and layer.
+    "VLLM_DEBUG_ATTN":
+    lambda: bool(int(os.getenv("VLLM_DEBUG_ATTN", "0"))),
 }
 
 # end-env-vars-definition
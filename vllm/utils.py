@@ -30,10 +30,11 @@ import types
 import uuid
 import warnings
 import weakref
+from array import array
 from asyncio import FIRST_COMPLETED, AbstractEventLoop, Task
 from collections import OrderedDict, UserDict, defaultdict
 from collections.abc import (AsyncGenerator, Awaitable, Generator, Hashable,
-                             Iterable, Iterator, Mapping)
+                             Iterable, Iterator, Mapping, Sequence)
 from dataclasses import dataclass, field
 from functools import cache, lru_cache, partial, wraps
 from typing import (TYPE_CHECKING, Any, Callable, Generic, Literal, NamedTuple,
@@ -827,6 +828,28 @@ def async_tensor_h2d(
     return t.to(device=target_device, non_blocking=True)
 
 
+def async_tensors_h2d(
+    data: Sequence[Union[list, array, npt.NDArray]],
+    dtype: torch.dtype,
+    target_device: Union[str, torch.device],
+    pin_memory: bool,
+) -> list[torch.Tensor]:
+    """Asynchronously create 1D tensors of the same dtype and copy them from
+    host to device.
+
+    The inputs are packed into a single host buffer so that only one copy is
+    issued; the returned tensors are views into the device buffer.
+    """
+    sizes = [len(x) for x in data]
+    t = torch.empty(sum(sizes), dtype=dtype, pin_memory=pin_memory)
+    t_np = t.numpy()
+    start = 0
+    for x, size in zip(data, sizes):
+        t_np[start:start + size] = x
+        start += size
+    return list(t.to(device=target_device, non_blocking=True).split(sizes))
+
+
 def get_dtype_size(dtype: torch.dtype) -> int:
     """Get the size of the data type in bytes."""
     return torch.tensor([], dtype=dtype).element_size()
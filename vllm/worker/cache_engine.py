@@ -73,7 +73,17 @@ class CacheEngine:
         """Allocates KV cache on the specified device."""
         kv_cache_shape = self.attn_backend.get_kv_cache_shape(
             num_blocks, self.block_size, self.num_kv_heads, self.head_size)
-        pin_memory = is_pin_memory_available() if device == "cpu" else False
+        if device == "cpu":
+            # The CPU cache is only the target of swaps, which overwrite whole
+            # blocks, and it has no null block. A single uninitialized pinned
+            # allocation avoids a host allocation and a memset per layer.
+            cpu_kv_cache = torch.empty(
+                (self.num_attention_layers, *kv_cache_shape),
+                dtype=self.dtype,
+                pin_memory=is_pin_memory_available(),
+                device=device)
+            return list(cpu_kv_cache.unbind(0))
+
         kv_cache: List[torch.Tensor] = []
 
         for _ in range(self.num_attention_layers):
@@ -82,7 +92,6 @@ class CacheEngine:
             # We zero-out everything for simplicity.
             layer_kv_cache = torch.zeros(kv_cache_shape,
                                          dtype=self.dtype,
-                                         pin_memory=pin_memory,
                                          device=device)
 
             # view back to (TOTAL_PAGES, PAGE_SIZE, entry_shape...) for cases
@@ -72,8 +72,7 @@ class MultiStepWorker(Worker):
             assert frozen_model_input.attn_metadata is not None
             # clear the cached metadata so that it can be recomputed on
             # the workers.
-            frozen_model_input.attn_metadata._cached_prefill_metadata = None
-            frozen_model_input.attn_metadata._cached_decode_metadata = None
+            frozen_model_input.attn_metadata.reset_cached_metadata()
 
         model_input.is_first_multi_step = is_first_multi_step
         model_input.is_last_step = execute_model_req.is_last_step